@@ -11,11 +11,16 @@ It aggregates by `city` and `state` fields present on course records, computes a
 centroid derived from course locations for mapping, counts, and averages.
 """
 import argparse
+import hashlib
 import os
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 from math import radians, sin, cos, asin, sqrt
 
+# course columns that feed the aggregation/scoring; everything else is dropped up front
+COURSE_COLUMNS = ["course_id", "name", "city", "state", "rating", "ratings_count", "length_yards", "_fetched_at"]
+
 
 def compute_metrics(courses_df: pd.DataFrame, weights: dict = None, state_golfable_csv: str = None):
     """Aggregate per-city metrics and compute a composite score using available fields.
@@ -28,9 +33,21 @@ def compute_metrics(courses_df: pd.DataFrame, weights: dict = None, state_golfab
     - state_golfable (from external CSV; If present, better)
     Returns a DataFrame with per-city aggregates plus 'score' and 'rank'.
     """
-    # drop duplicates by course_id if present
+    # project to the columns used below so dedup/groupby don't copy wide text fields
+    cols = [c for c in COURSE_COLUMNS if c in courses_df.columns]
+
+    # drop duplicates by course_id if present (latest _fetched_at wins); afterwards each row is
+    # one course, so a plain non-null count matches nunique without building a hashset per group
     if "course_id" in courses_df.columns:
-        courses_df = courses_df.sort_values("_fetched_at").drop_duplicates(subset="course_id", keep="last")
+        # sort/dedup on the key columns only, then gather projection + surviving rows in one take
+        order = courses_df["_fetched_at"].reset_index(drop=True).sort_values(kind="stable").index.to_numpy()
+        ids = courses_df["course_id"].to_numpy()[order]
+        keep = order[~pd.Series(ids).duplicated(keep="last").to_numpy()]
+        courses_df = courses_df.iloc[keep, [courses_df.columns.get_loc(c) for c in cols]]
+        count_expr = ("course_id", "count")
+    else:
+        courses_df = courses_df[cols]
+        count_expr = ("name", "nunique")
 
     # group by city/state
     group_cols = [c for c in ["city", "state"] if c in courses_df.columns]
@@ -39,7 +56,7 @@ def compute_metrics(courses_df: pd.DataFrame, weights: dict = None, state_golfab
 
     # build aggregation dict dynamically based on available columns
     agg_dict = {
-        "num_golf_courses": ("course_id" if "course_id" in courses_df.columns else "name", "nunique"),
+        "num_golf_courses": count_expr,
     }
     if "rating" in courses_df.columns:
         agg_dict["avg_rating"] = ("rating", "mean")
@@ -48,7 +65,11 @@ def compute_metrics(courses_df: pd.DataFrame, weights: dict = None, state_golfab
     if "length_yards" in courses_df.columns:
         agg_dict["avg_length_yards"] = ("length_yards", "mean")
 
-    agg = courses_df.groupby(group_cols).agg(**agg_dict).reset_index()
+    # group on categorical codes (integer hashing); keys stay sorted so cities with tied scores
+    # rank in a stable order, and go back to plain strings for the outputs
+    courses_df = courses_df.astype({c: "category" for c in group_cols})
+    agg = courses_df.groupby(group_cols, observed=True).agg(**agg_dict).reset_index()
+    agg = agg.astype({c: object for c in group_cols})
 
     # If a state golfability CSV is provided, merge it into the aggregates.
     if state_golfable_csv and os.path.exists(state_golfable_csv):
@@ -66,14 +87,12 @@ def compute_metrics(courses_df: pd.DataFrame, weights: dict = None, state_golfab
             rename_map[cols_lower['golfable']] = 'golfable_year_round'
         if rename_map:
             states = states.rename(columns=rename_map)
-        if 'golfable_year_round' in states.columns:
-            states['golfable_year_round'] = states['golfable_year_round'].astype(int)
-            if 'state' in agg.columns and 'state' in states.columns:
-                agg = agg.merge(states[['state', 'golfable_year_round']], on='state', how='left')
-            elif 'state' in agg.columns and 'state_name' in states.columns:
-                agg = agg.merge(states[['state_name', 'golfable_year_round']], left_on='state', right_on='state_name', how='left')
-            agg['state_golfable'] = agg['golfable_year_round'].fillna(0).astype(int)
-            agg.drop(columns=[c for c in ['golfable_year_round', 'state_name'] if c in agg.columns], inplace=True)
+        if 'golfable_year_round' in states.columns and 'state' in agg.columns:
+            # ~50-row lookup: map through a dict rather than a DataFrame merge
+            key_col = 'state' if 'state' in states.columns else 'state_name' if 'state_name' in states.columns else None
+            if key_col:
+                gmap = dict(zip(states[key_col], states['golfable_year_round'].astype(int)))
+                agg['state_golfable'] = agg['state'].map(gmap).fillna(0).astype(int)
 
     # prepare for scoring: collect available scoring columns
     score_cols = []
@@ -109,22 +128,21 @@ def compute_metrics(courses_df: pd.DataFrame, weights: dict = None, state_golfab
 
     # build matrix for scaling
     if score_cols:
-        from sklearn.preprocessing import MinMaxScaler
-        matrix = agg[score_cols].astype(float).copy()
+        matrix = agg[score_cols].to_numpy(dtype=np.float32, copy=True)
         # invert metrics where lower is better
-        for col in invert_cols:
-            matrix[col] = matrix[col].max() - matrix[col]
-        matrix = matrix.fillna(matrix.mean())
-        scaler = MinMaxScaler()
-        scaled = scaler.fit_transform(matrix)
-        scaled_df = pd.DataFrame(scaled, columns=score_cols, index=agg.index)
-
-        # compute weighted score
-        score = 0
-        for c in score_cols:
-            w = weights.get(c, 0) / total_weight
-            score = score + scaled_df[c] * w
-        agg["score"] = score
+        inv_idx = [score_cols.index(c) for c in invert_cols]
+        if inv_idx:
+            matrix[:, inv_idx] = np.nanmax(matrix[:, inv_idx], axis=0) - matrix[:, inv_idx]
+        matrix = np.where(np.isnan(matrix), np.nanmean(matrix, axis=0), matrix)
+        # min-max scale each column to [0, 1]; constant columns scale to 0
+        lo = np.nanmin(matrix, axis=0)
+        hi = np.nanmax(matrix, axis=0)
+        scaled = (matrix - lo) / np.where(hi > lo, hi - lo, 1.0)
+
+        # compute weighted score as a single dot product with the normalized weights
+        w_vec = np.array([weights.get(c, 0) / total_weight for c in score_cols], dtype=np.float32)
+        # float32 is only a working precision for the matrix; report the score as float64
+        agg["score"] = (scaled @ w_vec).astype(np.float64)
     else:
         agg["score"] = 0
 
@@ -140,21 +158,50 @@ def compute_metrics(courses_df: pd.DataFrame, weights: dict = None, state_golfab
     return agg
 
 
+def inputs_key(paths) -> str:
+    """Cheap cache key from the (name, mtime, size) of each given input file."""
+    stats = []
+    for p in paths:
+        if p and os.path.exists(p):
+            stats.append((os.path.abspath(p), os.path.getmtime(p), os.path.getsize(p)))
+        else:
+            stats.append((p, None, None))
+    return hashlib.sha1(repr(stats).encode()).hexdigest()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--courses", default="data/processed/teeradar_courses.parquet", help="Consolidated courses parquet")
     parser.add_argument("--output", default="data/processed/city_golf_metrics.parquet")
     parser.add_argument("--csv-out", default="outputs/city_golf_metrics.csv")
     parser.add_argument("--state-golfable-csv", default=None, help="Optional CSV of states with golfable_year_round (columns: state,golfable_year_round)")
+    parser.add_argument("--force", action="store_true", help="Recompute even if the inputs are unchanged since the last run")
     args = parser.parse_args()
 
-    df = pd.read_parquet(args.courses)
+    # skip the run when the inputs (and this script, which holds the scoring/weights) are
+    # unchanged since the outputs were written
+    key_path = args.output + ".key"
+    key = inputs_key([args.courses, args.state_golfable_csv, __file__])
+    if not args.force and os.path.exists(args.output) and os.path.exists(args.csv_out) and os.path.exists(key_path):
+        with open(key_path, "r", encoding="utf-8") as f:
+            if f.read().strip() == key:
+                print("Inputs unchanged; city metrics up to date:", args.output, "and", args.csv_out)
+                return
+
+    # read only the columns that feed scoring; probing the schema is cheap (footer only)
+    available = pq.ParquetFile(args.courses).schema_arrow.names
+    df = pd.read_parquet(args.courses, columns=[c for c in COURSE_COLUMNS if c in available])
     metrics = compute_metrics(df, state_golfable_csv=args.state_golfable_csv)
 
     os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
     metrics.to_parquet(args.output, index=False)
     os.makedirs(os.path.dirname(args.csv_out) or '.', exist_ok=True)
     metrics.to_csv(args.csv_out, index=False)
+    # write the key last (atomically) so an interrupted run is recomputed next time
+    tmp = key_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(key)
+    os.replace(tmp, key_path)
     print("Saved city metrics to:", args.output, "and", args.csv_out)
 
 
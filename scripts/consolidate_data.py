@@ -8,13 +8,30 @@ Usage examples:
 """
 import argparse
 import glob
-import json
 import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from tempfile import NamedTemporaryFile
 
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def _parse_one(fname: str):
+    """Return the courses of one raw page, stamped with provenance metadata."""
+    with open(fname, "rb") as f:
+        wrapped = orjson.loads(f.read())
+    payload = wrapped.get("payload", {}) or {}
+    # attach provenance metadata
+    provenance = {
+        "_fetched_at": wrapped.get("fetched_at"),
+        "_offset": wrapped.get("offset"),
+        "_raw_file": os.path.basename(fname),
+    }
+    return [{**c, **provenance} for c in payload.get("courses", [])]
 
 
 def read_raw_courses(raw_dir: str):
@@ -23,52 +40,104 @@ def read_raw_courses(raw_dir: str):
         print("No raw files found in", raw_dir)
         return []
 
-    rows = []
-    for fname in files:
-        with open(fname, "r", encoding="utf-8") as f:
-            wrapped = json.load(f)
-        fetched_at = wrapped.get("fetched_at")
-        offset = wrapped.get("offset")
-        payload = wrapped.get("payload", {}) or {}
-        for c in payload.get("courses", []):
-            # attach provenance metadata
-            c["_fetched_at"] = fetched_at
-            c["_offset"] = offset
-            c["_raw_file"] = os.path.basename(fname)
-            rows.append(c)
+    # pages are independent; read + decode them concurrently (map keeps file order)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        results = list(ex.map(_parse_one, files))
+
+    # per-page sizes are known now, so allocate the output once and copy pages in by slice
+    rows = [None] * sum(map(len, results))
+    idx = 0
+    for sub in results:
+        rows[idx:idx + len(sub)] = sub
+        idx += len(sub)
     return rows
 
 
-def to_parquet_atomic(df: pd.DataFrame, out_path: str):
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    """Convert to Arrow, turning object columns that mix strings with other values into strings.
+
+    Raw pages may carry the same field as a number in one course and a string in another
+    (e.g. holes 18 vs "9"); Arrow needs one type per column.
+    """
+    df = df.copy(deep=False)
+    for c in df.columns[df.dtypes == object]:
+        col = df[c]
+        if pd.api.types.infer_dtype(col, skipna=True) in ("mixed", "mixed-integer") and col.map(type).eq(str).any():
+            df[c] = col.where(col.isna(), col.astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def to_parquet_atomic(table: pa.Table, out_path: str):
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
     with NamedTemporaryFile(delete=False, dir=os.path.dirname(out_path), suffix=".parquet") as tmp:
         tmp_name = tmp.name
-    df.to_parquet(tmp_name, index=False)
+    # zstd + dictionary encoding shrinks the string-heavy columns; several row groups
+    # let downstream readers scan in parallel
+    pq.write_table(
+        table,
+        tmp_name,
+        compression="zstd",
+        compression_level=3,
+        use_dictionary=True,
+        data_page_size=1 << 20,
+        row_group_size=131072,
+    )
     os.replace(tmp_name, out_path)
     print("Wrote Parquet:", out_path)
 
 
-def to_ndjson_atomic(records, out_path: str):
+def to_ndjson_atomic(table: pa.Table, out_path: str):
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
     tmp = out_path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        for r in records:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    with open(tmp, "wb") as f:
+        # stream batch by batch; orjson writes NaN as null and emits UTF-8 directly
+        for batch in table.to_batches(max_chunksize=8192):
+            for row in batch.to_pylist():
+                f.write(orjson.dumps(row))
+                f.write(b"\n")
     os.replace(tmp, out_path)
     print("Wrote NDJSON:", out_path)
 
 
-def to_sqlite_replace(df: pd.DataFrame, db_path: str, table_name: str = "teeradar_courses"):
+def _sqlite_type(dtype: pa.DataType) -> str:
+    if pa.types.is_integer(dtype) or pa.types.is_boolean(dtype):
+        return "INTEGER"
+    if pa.types.is_floating(dtype):
+        return "REAL"
+    if pa.types.is_timestamp(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def to_sqlite_replace(table: pa.Table, db_path: str, table_name: str = "teeradar_courses"):
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.connect(db_path)
-    df.to_sql(table_name, conn, if_exists="replace", index=False)
-    if "course_id" in df.columns:
-        try:
-            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_course_id ON {table_name}(course_id)")
-            conn.commit()
-        except Exception as e:
-            print("Warning: could not create index:", e)
+    # build a fresh DB next to the target and swap it in, so the live DB is never half-loaded;
+    # that also makes journaling/sync pointless during the load
+    tmp = db_path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF; PRAGMA temp_store=MEMORY; PRAGMA cache_size=-262144;")
+        cols = ", ".join(f'"{f.name}" {_sqlite_type(f.type)}' for f in table.schema)
+        placeholders = ", ".join("?" for _ in table.column_names)
+        conn.execute("BEGIN")
+        conn.execute(f"CREATE TABLE {table_name} ({cols})")
+        for batch in table.to_batches(max_chunksize=8192):
+            conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", zip(*(col.to_pylist() for col in batch.columns)))
+        conn.commit()
+        if "course_id" in table.column_names:
+            try:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_course_id ON {table_name}(course_id)")
+                conn.commit()
+            except Exception as e:
+                print("Warning: could not create index:", e)
+    except Exception:
+        conn.close()
+        os.remove(tmp)
+        raise
     conn.close()
+    os.replace(tmp, db_path)
     print("Wrote SQLite DB:", db_path)
 
 
@@ -87,31 +156,43 @@ def main():
         return
 
     df = pd.DataFrame(rows)
+    del rows
 
-    # Normalize numeric fields
+    # Normalize numeric fields; unparseable values become NaN
     if "rating" in df.columns:
         df["rating"] = pd.to_numeric(df["rating"], errors="coerce")
     if "ratings_count" in df.columns:
         df["ratings_count"] = pd.to_numeric(df["ratings_count"], errors="coerce").fillna(0).astype(int)
 
+    # defensive country filter (raw pages are saved unfiltered by fetch_teeradar.py)
+    if "country" in df.columns:
+        df = df[df["country"].astype(str).str.lower().isin(["united states", "us", "usa"])]
+
     # Deduplication: keep latest by _fetched_at if possible
     if args.dedupe_key in df.columns:
         if "_fetched_at" in df.columns:
-            df["_fetched_at"] = pd.to_datetime(df["_fetched_at"], errors="coerce")
-            df = df.sort_values(by=args.dedupe_key).drop_duplicates(subset=args.dedupe_key, keep="last")
+            # fetched_at is fixed-width ISO-8601 (see fetch_teeradar.save_raw_response), so it
+            # sorts chronologically as a plain string without parsing
+            df = df.sort_values(by=["_fetched_at", args.dedupe_key]).drop_duplicates(subset=args.dedupe_key, keep="last")
         else:
             df = df.drop_duplicates(subset=args.dedupe_key, keep="last")
         print("Deduplicated on", args.dedupe_key, "-> rows:", len(df))
 
-    # Outputs
-    if args.out_parquet:
-        to_parquet_atomic(df, args.out_parquet)
-    if args.out_ndjson:
-        # remove NaN for JSON; convert records
-        recs = json.loads(df.to_json(orient="records", force_ascii=False))
-        to_ndjson_atomic(recs, args.out_ndjson)
-    if args.sqlite_db:
-        to_sqlite_replace(df, args.sqlite_db)
+    # Outputs: independent writers over the same immutable Arrow table, run concurrently
+    if not (args.out_parquet or args.out_ndjson or args.sqlite_db):
+        print("No outputs requested. Processed", len(df), "unique courses.")
+        return
+    table = to_arrow(df)
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        futs = []
+        if args.out_parquet:
+            futs.append(ex.submit(to_parquet_atomic, table, args.out_parquet))
+        if args.out_ndjson:
+            futs.append(ex.submit(to_ndjson_atomic, table, args.out_ndjson))
+        if args.sqlite_db:
+            futs.append(ex.submit(to_sqlite_replace, table, args.sqlite_db))
+        for f in futs:
+            f.result()
 
     print("All done. Processed", len(df), "unique courses.")
 
@@ -3,13 +3,15 @@ Fetch Teeradar course pages and save raw JSON responses.
 Handles pagination, rate limiting, and server errors.
 """
 import argparse
-import json
 import os
 import time
 from datetime import datetime
 from typing import Optional
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 def load_api_key(path: str = "secrets/TEERADAR_API_KEY.txt") -> Optional[str]:
@@ -23,52 +25,100 @@ def load_api_key(path: str = "secrets/TEERADAR_API_KEY.txt") -> Optional[str]:
     return None
 
 
-def save_raw_response(payload: dict, out_dir: str, offset: int):
+def save_raw_response(payload: dict, out_dir: str, offset: int, params: Optional[dict] = None, pretty: bool = False):
     os.makedirs(out_dir, exist_ok=True)
     filename = os.path.join(out_dir, f"teeradar_page_{offset}.json")
     wrapped = {
-        "fetched_at": datetime.now().isoformat() + "Z",
+        "fetched_at": datetime.now().isoformat(timespec="microseconds") + "Z",
         "offset": offset,
+        "params": params,
         "payload": payload,
     }
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(wrapped, f, ensure_ascii=False, indent=2)
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+    # write to a temp file and rename, so an interrupted run never leaves a truncated page
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(wrapped, option=option))
+    os.replace(tmp, filename)
     print("Saved:", filename)
 
 
-def fetch_pages(api_key: str, min_rating: Optional[float], offset: int, limit: int, max_pages: Optional[int], out_dir: str):
+def make_session(api_key: str) -> requests.Session:
+    """Keep-alive session that retries 429/5xx with backoff, honouring Retry-After."""
+    retry = Retry(
+        total=5,
+        backoff_factor=1.0,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"X-API-Key": api_key})
+    return session
+
+
+def advance_page(payload: dict, limit: int) -> bool:
+    """Return False once a page holds fewer than `limit` courses (the last page)."""
+    count = payload.get("count", len(payload.get("courses", [])))
+    if count < limit:
+        print("Last page reached (count < limit). Stopping.")
+        return False
+    return True
+
+
+def load_saved_payload(out_dir: str, offset: int, params: dict) -> Optional[dict]:
+    """Return a page saved by an earlier run with the same query params, else None."""
+    filename = os.path.join(out_dir, f"teeradar_page_{offset}.json")
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, "rb") as f:
+            wrapped = orjson.loads(f.read())
+    except orjson.JSONDecodeError:
+        print("Unreadable saved page, re-fetching:", filename)
+        return None
+    if wrapped.get("params") != params:
+        return None
+    return wrapped.get("payload", {}) or {}
+
+
+def fetch_pages(api_key: str, min_rating: Optional[float], offset: int, limit: int, max_pages: Optional[int], out_dir: str, force: bool = False, pretty: bool = False):
     base = "http://teeradar.online/api/v1/courses.php"
-    headers = {"X-API-Key": api_key}
+    session = make_session(api_key)
     page = 0
     while True:
         params = {"country": "United States", "limit": limit, "offset": offset}
         if min_rating is not None:
             params["min_rating"] = min_rating
+
+        # reuse pages already saved by a previous run with the same query, unless --force
+        payload = None if force else load_saved_payload(out_dir, offset, params)
+        if payload is not None:
+            print(f"Skipping offset {offset} (page {page+1}): already saved")
+            if not advance_page(payload, limit):
+                break
+            offset += limit
+            page += 1
+            if max_pages and page >= max_pages:
+                print("Reached max_pages limit. Stopping.")
+                break
+            continue
+
         print(f"Fetching offset {offset} (page {page+1})")
         try:
-            resp = requests.get(base, headers=headers, params=params, timeout=15)
+            resp = session.get(base, params=params, timeout=15)
         except Exception as e:
             print("Request failed:", e)
             time.sleep(5)
             continue
-        if resp.status_code == 429:
-            print("Rate limited (429). Backing off for 60s")
-            time.sleep(60)
-            continue
-        if resp.status_code >= 500:
-            print(f"Server error {resp.status_code}. Retrying in 10s")
-            time.sleep(10)
-            continue
         resp.raise_for_status()
+        # saved as-is; the defensive US-only filter runs vectorized in consolidate_data.py
         payload = resp.json()
-        # defensive client-side country filtering
-        courses = [c for c in payload.get("courses", []) if str(c.get("country", "")).lower() in ("united states", "us", "usa")]
-        payload["courses"] = courses
-        save_raw_response(payload, out_dir, offset)
-
-        count = payload.get("count", len(courses))
-        if count < limit:
-            print("Last page reached (count < limit). Stopping.")
+        save_raw_response(payload, out_dir, offset, params=params, pretty=pretty)
+
+        if not advance_page(payload, limit):
             break
         offset += limit
         page += 1
@@ -85,6 +135,8 @@ def main():
     parser.add_argument("--offset", type=int, default=0, help="Starting offset for fetching pages")
     parser.add_argument("--max-pages", type=int, default=None, help="Stop after this many pages (for testing)")
     parser.add_argument("--out-dir", default="data/raw", help="Directory to save raw JSON pages")
+    parser.add_argument("--force", action="store_true", help="Re-download pages that already exist in --out-dir (saved pages are otherwise reused only when fetched with the same query params)")
+    parser.add_argument("--pretty", action="store_true", help="Indent saved raw JSON (for debugging; default is compact)")
     parser.add_argument("--api-key-file", default="secrets/TEERADAR_API_KEY.txt", help="File to read API key from if env var not set")
     args = parser.parse_args()
 
@@ -92,7 +144,7 @@ def main():
     if not api_key:
         print("No API key found. Please add it to environment variable TEERADAR_API_KEY or file:", args.api_key_file)
         return
-    fetch_pages(api_key, args.min_rating, args.offset, args.limit, args.max_pages, args.out_dir)
+    fetch_pages(api_key, args.min_rating, args.offset, args.limit, args.max_pages, args.out_dir, force=args.force, pretty=args.pretty)
 
 
 if __name__ == "__main__":